@@ -140,3 +140,23 @@ STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
 
 STRIPE_USE_PAYMENT_INTENT = os.getenv('STRIPE_USE_PAYMENT_INTENT')
+
+# Rate limiting of payment-creation endpoints (see store/ratelimit.py).
+# Buckets, single-flight locks/results and metrics live in STORE_RATELIMIT_CACHE. The default
+# locmem cache is per process: with several gunicorn workers point it at a shared cache
+# (e.g. Redis), otherwise limits, coalescing and metrics only apply within each worker.
+STORE_RATELIMIT_CACHE = 'default'
+STORE_RATELIMIT_CLIENT_RATE = float(os.getenv('STORE_RATELIMIT_CLIENT_RATE', '0.5'))
+STORE_RATELIMIT_CLIENT_BURST = int(os.getenv('STORE_RATELIMIT_CLIENT_BURST', '10'))
+STORE_RATELIMIT_OBJECT_RATE = float(os.getenv('STORE_RATELIMIT_OBJECT_RATE', '2'))
+STORE_RATELIMIT_OBJECT_BURST = int(os.getenv('STORE_RATELIMIT_OBJECT_BURST', '30'))
+# Number of reverse proxies in front of the app (1 on Render). With 0 clients are identified by
+# REMOTE_ADDR, so behind a proxy all visitors share one per-client bucket.
+STORE_RATELIMIT_TRUSTED_PROXIES = int(os.getenv('STORE_RATELIMIT_TRUSTED_PROXIES', '0'))
+STORE_RATELIMIT_COALESCE_TIMEOUT = int(os.getenv('STORE_RATELIMIT_COALESCE_TIMEOUT', '30'))
+
+# Exchange rates for mixed-currency orders (see store/fx.py).
+# Rates are quoted against STORE_FX_BASE_CURRENCY and cached in-process; the cache is reloaded when
+# the rates in the database change, and at the latest after STORE_FX_TTL seconds.
+STORE_FX_BASE_CURRENCY = os.getenv('STORE_FX_BASE_CURRENCY', 'usd')
+STORE_FX_TTL = int(os.getenv('STORE_FX_TTL', '300'))
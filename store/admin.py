@@ -7,9 +7,11 @@ to enable management through the admin interface.
 
 from django.contrib import admin
 
-from .models import Item, Discount, Tax, Order
+from .models import Item, Discount, Tax, Order, ArchivedOrder, ExchangeRate
 
 admin.site.register(Item)
 admin.site.register(Discount)
 admin.site.register(Tax)
 admin.site.register(Order)
+admin.site.register(ArchivedOrder)
+admin.site.register(ExchangeRate)
@@ -0,0 +1,143 @@
+"""
+Exchange Rates Module
+
+Converts item prices into an order's settlement currency using the
+`ExchangeRate` table, held in an in-process cache so pricing an order never
+queries the database per line: each lookup costs one small version query,
+and the table itself is only reloaded when it changes.
+
+Main Components:
+    - base_currency: Returns the currency all rates are quoted against.
+    - get_rates: Returns the cached {currency: rate} table, reloading it when
+      the TTL expires or the rates version in the database changes.
+    - convert: Converts an amount between two currencies.
+    - ExchangeRateMissing: Raised when a conversion needs an unknown rate.
+
+Settings:
+    - STORE_FX_BASE_CURRENCY (str): Currency all rates are quoted against (rate 1).
+    - STORE_FX_TTL (int): Seconds a process may keep its table without reloading.
+"""
+
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Count, Max
+
+DEFAULTS = {
+    'STORE_FX_BASE_CURRENCY': 'usd',
+    'STORE_FX_TTL': 300,
+}
+
+CENT = Decimal('0.01')
+
+
+def _setting(name):
+    return getattr(settings, name, DEFAULTS[name])
+
+
+def base_currency():
+    """
+    Returns the currency all exchange rates are quoted against.
+    """
+    return _setting('STORE_FX_BASE_CURRENCY').lower()
+
+
+class ExchangeRateMissing(LookupError):
+    """
+    Raised when there is no exchange rate for a currency used in an order.
+    """
+
+
+class RateTableCache:
+    """
+    In-process copy of the exchange rate table.
+
+    The table is reloaded when it is older than STORE_FX_TTL or when the rates
+    version — the number of rows and the latest `updated_at` — differs from the
+    loaded one. The version is read from the database, so rates saved by any
+    process (admin, `load_exchange_rates`) are picked up by every worker on its
+    next lookup. Bulk `QuerySet.update()` calls do not touch `updated_at` and
+    are only picked up after the TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rates = None
+        self._version = None
+        self._loaded_at = 0.0
+
+    @staticmethod
+    def current_version():
+        """
+        Returns the rates version stored in the database.
+        """
+        exchange_rate = apps.get_model('store', 'ExchangeRate')
+        version = exchange_rate.objects.aggregate(count=Count('pk'),
+                                                  updated_at=Max('updated_at'))
+        return version['count'], version['updated_at']
+
+    def get(self):
+        """
+        Returns the {currency: Decimal rate} table, reloading it if stale.
+        """
+        version = self.current_version()
+        with self._lock:
+            fresh = time.monotonic() - self._loaded_at < _setting('STORE_FX_TTL')
+            if self._rates is None or not fresh or self._version != version:
+                self._rates = self._load()
+                self._version = version
+                self._loaded_at = time.monotonic()
+            return self._rates
+
+    def clear(self):
+        """
+        Drops the in-process table so the next access reloads it.
+        """
+        with self._lock:
+            self._rates = None
+
+    @staticmethod
+    def _load():
+        exchange_rate = apps.get_model('store', 'ExchangeRate')
+        rates = dict(exchange_rate.objects.values_list('currency', 'rate'))
+        rates[base_currency()] = Decimal('1')
+        return rates
+
+
+rate_table = RateTableCache()
+
+
+def get_rates():
+    """
+    Returns the cached exchange rate table: units of each currency per one
+    unit of STORE_FX_BASE_CURRENCY.
+    """
+    return rate_table.get()
+
+
+def convert(amount, from_currency, to_currency, rates=None):
+    """
+    Converts `amount` from one currency to another, rounded to cents.
+
+    :param amount: Decimal amount in `from_currency`.
+    :param from_currency: Source currency code, e.g. 'pln'.
+    :param to_currency: Target currency code, e.g. 'usd'.
+    :param rates: Rate table from get_rates(); fetched if omitted.
+    :return: Decimal amount in `to_currency`.
+    :raises ExchangeRateMissing: If either currency has no rate.
+    """
+    from_currency, to_currency = from_currency.lower(), to_currency.lower()
+    if from_currency == to_currency:
+        return amount
+
+    if rates is None:
+        rates = get_rates()
+    for currency in (from_currency, to_currency):
+        if currency not in rates:
+            raise ExchangeRateMissing(f"No exchange rate for {currency.upper()}.")
+
+    converted = Decimal(amount) / rates[from_currency] * rates[to_currency]
+    return converted.quantize(CENT, rounding=ROUND_HALF_UP)
@@ -0,0 +1,253 @@
+"""
+Archive Orders Command
+
+Moves orders older than a cutoff into the compact `ArchivedOrder` table.
+
+Orders are processed in bounded batches, each in its own short transaction:
+the batch rows are locked (skipping rows locked by other transactions where the
+database supports it), snapshotted together with their item links and computed
+totals, inserted into the archive and deleted from the live tables. Orders
+whose totals need a missing exchange rate are skipped and reported.
+
+Usage:
+    python manage.py archive_orders --days 365
+    python manage.py archive_orders --before 2024-01-01 --batch-size 200 --sleep 0.5
+    python manage.py archive_orders --days 365 --partitioned   # PostgreSQL only
+"""
+
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from store.fx import ExchangeRateMissing
+from store.models import ArchivedOrder, Order
+
+
+def _month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _next_month(value):
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def is_partitioned(table):
+    """
+    Returns True if the PostgreSQL table is already a partitioned table.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [table])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def ensure_partitions(table, timestamps, parent=None):
+    """
+    Creates the monthly partitions covering the given timestamps.
+
+    Partitions are always named after `table` (e.g. `<table>_y2024m05`), even
+    when attached to another `parent` during conversion, so that they keep
+    matching names once the parent is renamed to `table`.
+    """
+    quote = connection.ops.quote_name
+    months = {_month_start(value) for value in timestamps}
+    with connection.cursor() as cursor:
+        for start in sorted(months):
+            partition = f"{table}_y{start.year}m{start.month:02d}"
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {quote(partition)} "
+                f"PARTITION OF {quote(parent or table)} FOR VALUES FROM (%s) TO (%s)",
+                [start.isoformat(), _next_month(start).isoformat()],
+            )
+
+
+def convert_to_partitioned(table, batch_size):
+    """
+    Rebuilds `table` as a table partitioned by month of `created_at`.
+
+    The primary key becomes (order_id, created_at), as PostgreSQL requires the
+    partition key in every unique constraint. Rows are copied into a staging
+    table in batches of `batch_size`, each in its own transaction, so the archive
+    stays readable and writable meanwhile. Only the final step — copying rows
+    archived during the copy and swapping the tables — holds an exclusive lock.
+    """
+    quote = connection.ops.quote_name
+    staging = f"{table}_partitioned"
+    # Rows archived after this moment are copied again under the final lock;
+    # the margin covers clock skew between application servers.
+    copy_started_at = timezone.now() - timedelta(minutes=5)
+
+    with connection.cursor() as cursor:
+        # Leftovers of an interrupted conversion are rebuilt from scratch.
+        cursor.execute(f"DROP TABLE IF EXISTS {quote(staging)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(staging)} (LIKE {quote(table)} INCLUDING DEFAULTS, "
+            f"PRIMARY KEY (order_id, created_at)) PARTITION BY RANGE (created_at)"
+        )
+
+    last_id = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT order_id, created_at FROM {quote(table)} "
+                f"WHERE order_id > %s ORDER BY order_id LIMIT %s",
+                [last_id, batch_size],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            ensure_partitions(table, [row[1] for row in rows], parent=staging)
+            cursor.execute(
+                f"INSERT INTO {quote(staging)} SELECT * FROM {quote(table)} "
+                f"WHERE order_id > %s AND order_id <= %s",
+                [last_id, rows[-1][0]],
+            )
+            last_id = rows[-1][0]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE")
+        late_rows = (f"FROM {quote(table)} "
+                     f"WHERE order_id > %s OR archived_at >= %s")
+        cursor.execute(f"SELECT created_at {late_rows}", [last_id, copy_started_at])
+        ensure_partitions(table, [row[0] for row in cursor.fetchall()], parent=staging)
+        cursor.execute(
+            f"INSERT INTO {quote(staging)} SELECT * {late_rows} "
+            f"ON CONFLICT (order_id, created_at) DO NOTHING",
+            [last_id, copy_started_at],
+        )
+        cursor.execute(f"DROP TABLE {quote(table)}")
+        cursor.execute(f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}")
+        cursor.execute(f"ALTER INDEX {quote(staging + '_pkey')} RENAME TO {quote(table + '_pkey')}")
+
+
+class Command(BaseCommand):
+    """
+    Management command moving old orders into the archive in bounded batches.
+    """
+    help = "Moves orders older than a cutoff into the ArchivedOrder table in batches."
+
+    def add_arguments(self, parser):
+        cutoff = parser.add_mutually_exclusive_group(required=True)
+        cutoff.add_argument('--days', type=int,
+                            help="Archive orders created more than this many days ago.")
+        cutoff.add_argument('--before',
+                            help="Archive orders created before this date/datetime (ISO 8601).")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of orders moved per transaction (default: 500).")
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Seconds to pause between batches (default: 0).")
+        parser.add_argument('--partitioned', action='store_true',
+                            help="PostgreSQL only: convert the archive table to a "
+                                 "monthly-partitioned layout if it is not one yet.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many orders would be archived.")
+
+    def handle(self, *args, **options):
+        cutoff = self.get_cutoff(options)
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive integer.")
+
+        pending = Order.objects.filter(created_at__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f"{pending.count()} order(s) created before "
+                              f"{cutoff.isoformat()} would be archived.")
+            return
+
+        table = ArchivedOrder._meta.db_table  # pylint: disable=protected-access
+        if options['partitioned']:
+            if connection.vendor != 'postgresql':
+                raise CommandError("--partitioned is only supported on PostgreSQL.")
+            if not is_partitioned(table):
+                convert_to_partitioned(table, batch_size)
+                self.stdout.write(f"Converted {table} to a monthly-partitioned table.")
+        # Once converted, the table stays partitioned: partitions are needed on every run.
+        partitioned = connection.vendor == 'postgresql' and is_partitioned(table)
+
+        total = 0
+        skipped = []
+        while True:
+            moved, unpriced = self.archive_batch(pending.exclude(pk__in=skipped),
+                                                 batch_size, partitioned, table)
+            if not moved and not unpriced:
+                break
+            skipped.extend(unpriced)
+            total += moved
+            self.stdout.write(f"Archived {moved} order(s) ({total} so far).")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total} order(s) created before {cutoff.isoformat()}."))
+        if skipped:
+            self.stderr.write(
+                f"Skipped {len(skipped)} order(s) with missing exchange rates: "
+                f"{', '.join(f'#{order_id}' for order_id in skipped)}. "
+                f"Load the rates and run the command again.")
+
+    @staticmethod
+    def get_cutoff(options):
+        """
+        Returns the aware datetime before which orders are archived.
+        """
+        if options['days'] is not None:
+            if options['days'] < 0:
+                raise CommandError("--days must not be negative.")
+            return timezone.now() - timedelta(days=options['days'])
+
+        value = parse_datetime(options['before'])
+        if value is None:
+            date = parse_date(options['before'])
+            if date is None:
+                raise CommandError(f"Invalid --before value: {options['before']!r}.")
+            value = datetime(date.year, date.month, date.day)
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    @staticmethod
+    def archive_batch(pending, batch_size, partitioned, table):
+        """
+        Moves one batch of orders into the archive.
+
+        Orders whose totals cannot be computed because an exchange rate is
+        missing are left in place and reported back.
+
+        :return: Tuple (number of orders archived, IDs of skipped orders);
+            (0, []) when nothing is left.
+        """
+        with transaction.atomic():
+            locked = pending.order_by('created_at', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                locked = locked.select_for_update(skip_locked=True)
+            else:
+                locked = locked.select_for_update()
+            ids = list(locked.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return 0, []
+
+            orders = (Order.objects.filter(pk__in=ids)
+                      .select_related('discount', 'tax')
+                      .prefetch_related('items'))
+            archived = []
+            skipped = []
+            for order in orders:
+                try:
+                    archived.append(ArchivedOrder.from_order(order))
+                except ExchangeRateMissing:
+                    skipped.append(order.pk)
+
+            if partitioned:
+                ensure_partitions(table, [entry.created_at for entry in archived])
+            ArchivedOrder.objects.bulk_create(archived)
+            # Deleting the orders also removes their rows in the items M2M table.
+            Order.objects.filter(pk__in=[entry.order_id for entry in archived]).delete()
+
+        return len(archived), skipped
@@ -0,0 +1,111 @@
+"""
+Load Exchange Rates Command
+
+Loads `ExchangeRate` rows from a local JSON or CSV file and/or from the
+command line. Web workers pick up the saved rates on their next lookup.
+
+Rates are units of each currency per one unit of STORE_FX_BASE_CURRENCY.
+
+File formats:
+    JSON: {"base": "usd", "rates": {"pln": "3.95"}}   ("base" is optional)
+    CSV:  one "currency,rate" pair per line, e.g. "pln,3.95"
+
+Usage:
+    python manage.py load_exchange_rates rates.json
+    python manage.py load_exchange_rates --rate pln=3.95
+"""
+
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store import fx
+from store.models import ExchangeRate, Item
+
+
+def read_rates_file(path):
+    """
+    Returns a list of (currency, rate string) pairs read from a JSON or CSV file.
+    """
+    path = Path(path)
+    try:
+        content = path.read_text(encoding='utf-8')
+    except OSError as e:
+        raise CommandError(f"Cannot read {path}: {e}") from e
+
+    if path.suffix.lower() == '.json':
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise CommandError(f"Invalid JSON in {path}: {e}") from e
+        if not isinstance(data, dict) or not isinstance(data.get('rates', {}), dict):
+            raise CommandError(f"Expected an object with a 'rates' mapping in {path}.")
+        base = str(data.get('base', fx.base_currency())).lower()
+        if base != fx.base_currency():
+            raise CommandError(f"Rates in {path} are quoted against {base.upper()}, "
+                               f"expected {fx.base_currency().upper()}.")
+        return list(data.get('rates', {}).items())
+
+    pairs = []
+    for line_no, row in enumerate(csv.reader(content.splitlines()), start=1):
+        if not row or row[0].startswith('#'):
+            continue
+        if len(row) != 2:
+            raise CommandError(f"{path}:{line_no}: expected 'currency,rate'.")
+        pairs.append(tuple(row))
+    return pairs
+
+
+def parse_rate(currency, rate):
+    """
+    Validates one rate and returns it as (currency, Decimal).
+    """
+    currency = str(currency).strip().lower()
+    if currency not in dict(Item.CURRENCY_CHOICES):
+        raise CommandError(f"Unknown currency: {currency!r}.")
+    if currency == fx.base_currency():
+        raise CommandError(f"{currency.upper()} is the base currency; its rate is always 1.")
+    try:
+        value = Decimal(str(rate).strip())
+    except InvalidOperation as e:
+        raise CommandError(f"Invalid rate for {currency.upper()}: {rate!r}.") from e
+    if not value.is_finite() or value <= 0:
+        raise CommandError(f"Rate for {currency.upper()} must be positive.")
+    return currency, value
+
+
+class Command(BaseCommand):
+    """
+    Management command loading exchange rates into the ExchangeRate table.
+    """
+    help = "Loads exchange rates from a JSON/CSV file or --rate options."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?',
+                            help="JSON or CSV file with exchange rates.")
+        parser.add_argument('--rate', action='append', default=[], metavar='CURRENCY=RATE',
+                            help="Set a single rate, e.g. --rate pln=3.95 (repeatable).")
+
+    def handle(self, *args, **options):
+        pairs = read_rates_file(options['path']) if options['path'] else []
+        for value in options['rate']:
+            currency, sep, rate = value.partition('=')
+            if not sep:
+                raise CommandError(f"Expected CURRENCY=RATE, got {value!r}.")
+            pairs.append((currency, rate))
+
+        if not pairs:
+            raise CommandError("No exchange rates given: pass a file and/or --rate.")
+
+        rates = dict(parse_rate(*pair) for pair in pairs)
+        with transaction.atomic():
+            for currency, rate in rates.items():
+                ExchangeRate.objects.update_or_create(currency=currency,
+                                                      defaults={'rate': rate})
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {len(rates)} exchange rate(s) against {fx.base_currency().upper()}."))
@@ -1,11 +1,16 @@
 """
 Models Module
 
-Defines the `Item` model used to represent products in the store application.
+Defines the `Item` model used to represent products in the store application,
+along with orders, their compact archive and exchange rates.
 """
 
+from collections import namedtuple
+
 from django.db import models
 
+from . import fx
+
 
 class Item(models.Model):
     """
@@ -71,15 +76,49 @@ class Tax(models.Model):
         return f"{self.name} — {self.percentage}%"
 
 
+class ExchangeRate(models.Model):
+    """
+    Exchange rate of a currency against the base currency (STORE_FX_BASE_CURRENCY).
+
+    Rows are read through the in-process cache in `store.fx`, which reloads
+    them whenever the number of rows or the latest `updated_at` changes.
+
+    Fields:
+        - currency (str): Currency code, e.g. 'pln'.
+        - rate (Decimal): Units of `currency` per one unit of the base currency.
+        - updated_at (DateTime): Timestamp of the last change.
+    """
+    currency = models.CharField(
+        max_length=3,
+        choices=Item.CURRENCY_CHOICES,
+        unique=True
+    )
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"1 {fx.base_currency().upper()} = {self.rate} {self.currency.upper()}"
+
+
+OrderPricing = namedtuple(
+    'OrderPricing',
+    ['currency', 'lines', 'subtotal', 'discount', 'tax', 'total']
+)
+
+
 class Order(models.Model):
     """
     An order consisting of multiple items, with optional discount and tax.
 
+    Item prices are converted into the order's settlement currency
+    (see `currency()`) using the cached exchange rates.
+
     Fields:
         - items (ManyToMany to Item): List of items in the order.
         - discount (ForeignKey to Discount, nullable): Applied discount (optional).
         - tax (ForeignKey to Tax, nullable): Applied tax (optional).
         - created_at (DateTime): Timestamp when the order was created.
+        - settlement_currency (str, optional): Currency the order is paid in.
     """
     items = models.ManyToManyField(
         Item,
@@ -97,24 +136,70 @@ class Order(models.Model):
         null=True,
         blank=True
     )
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    settlement_currency = models.CharField(
+        max_length=3,
+        choices=Item.CURRENCY_CHOICES,
+        blank=True
+    )
 
     def __str__(self):
         return f"Order #{self.id} — {self.created_at.strftime('%Y-%m-%d %H:%M')}"
 
+    def converted_items(self):
+        """
+        Returns a list of (item, price) pairs with each price converted
+        into the order's settlement currency.
+
+        :raises ExchangeRateMissing: If an item's currency has no exchange rate.
+        """
+        return self._convert_items()[1]
+
+    def _convert_items(self):
+        items = list(self.items.all())
+        currency = self._settlement_currency(items)
+        rates = fx.get_rates()
+        return currency, [(item, fx.convert(item.price, item.currency, currency, rates))
+                          for item in items]
+
+    def pricing(self):
+        """
+        Computes all order amounts in the settlement currency in one pass,
+        converting the item prices only once.
+
+        :return: OrderPricing with currency, lines, subtotal, discount, tax and total.
+        :raises ExchangeRateMissing: If an item's currency has no exchange rate.
+        """
+        currency, lines = self._convert_items()
+        subtotal = sum(price for _, price in lines)
+
+        discount = subtotal * (self.discount.percentage / 100) if self.discount else 0
+        discount = round(discount, 2)
+
+        tax = (subtotal - discount) * (self.tax.percentage / 100) if self.tax else 0
+        tax = round(tax, 2)
+
+        return OrderPricing(
+            currency=currency,
+            lines=lines,
+            subtotal=subtotal,
+            discount=discount,
+            tax=tax,
+            total=subtotal - discount + tax,
+        )
+
     def subtotal(self):
         """
-        Returns the total price of all items without applying discounts or taxes.
+        Returns the total price of all items in the settlement currency
+        without applying discounts or taxes.
         """
-        return sum(item.price for item in self.items.all())
+        return self.pricing().subtotal
 
     def discount_amount(self):
         """
         Returns the discount amount. Returns 0 if no discount is applied.
         """
-        base = self.subtotal()
-        amount = base * (self.discount.percentage / 100) if self.discount else 0
-        return round(amount, 2)
+        return self.pricing().discount
 
     def tax_amount(self):
         """
@@ -122,20 +207,94 @@ class Order(models.Model):
         (subtotal - discount) * (tax percentage / 100).
         Returns 0 if no tax is applied.
         """
-        base = self.subtotal() - self.discount_amount()
-        amount = base * (self.tax.percentage / 100) if self.tax else 0
-        return round(amount, 2)
+        return self.pricing().tax
 
     def total_amount(self):
         """
         Returns the final total amount after applying discount and tax.
         """
-        return self.subtotal() - self.discount_amount() + self.tax_amount()
+        return self.pricing().total
 
     def currency(self):
         """
-        Assumes all items in the order share the same currency.
-        Returns the currency of the first item, or 'usd' if the order is empty.
+        Returns the settlement currency: `settlement_currency` if set, otherwise
+        the currency of the first item, or 'usd' if the order is empty.
         """
-        first_item = self.items.first()
+        return self._settlement_currency(self.items.all())
+
+    def _settlement_currency(self, items):
+        if self.settlement_currency:
+            return self.settlement_currency
+        first_item = min(items, key=lambda item: item.pk, default=None)
         return first_item.currency if first_item else 'usd'
+
+
+class ArchivedOrder(models.Model):
+    """
+    A read-only snapshot of an Order moved out of the live tables by `archive_orders`.
+
+    Item links and computed totals are stored inline, so an archived order stays
+    readable even after its items, discount or tax are changed or deleted.
+    On PostgreSQL the table can be partitioned by month of `created_at`.
+
+    Fields:
+        - order_id (int): ID of the original order (primary key).
+        - created_at (DateTime): Creation timestamp of the original order.
+        - archived_at (DateTime): Timestamp when the order was archived.
+        - items (JSON): List of {"item_id", "name", "price", "currency"} snapshots.
+        - discount_code, discount_percentage: Applied discount, if any.
+        - tax_name, tax_percentage: Applied tax, if any.
+        - currency (str): Currency of the order totals.
+        - subtotal, discount_amount, tax_amount, total_amount (Decimal): Computed totals.
+    """
+    order_id = models.BigIntegerField(primary_key=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    items = models.JSONField(default=list)
+    discount_code = models.CharField(max_length=50, blank=True)
+    discount_percentage = models.DecimalField(max_digits=10, decimal_places=2,
+                                              null=True, blank=True)
+    tax_name = models.CharField(max_length=50, blank=True)
+    tax_percentage = models.DecimalField(max_digits=5, decimal_places=2,
+                                         null=True, blank=True)
+    currency = models.CharField(max_length=3)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2)
+    discount_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    tax_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __str__(self):
+        return (f"Archived order #{self.order_id} — "
+                f"{self.created_at.strftime('%Y-%m-%d %H:%M')}")
+
+    @classmethod
+    def from_order(cls, order):
+        """
+        Builds (without saving) an archive snapshot of the given order.
+        Expects `items`, `discount` and `tax` to be prefetched/selected.
+
+        :raises ExchangeRateMissing: If an item's currency has no exchange rate.
+        """
+        pricing = order.pricing()
+        return cls(
+            order_id=order.id,
+            created_at=order.created_at,
+            items=[
+                {
+                    'item_id': item.id,
+                    'name': item.name,
+                    'price': str(item.price),
+                    'currency': item.currency,
+                }
+                for item in order.items.all()
+            ],
+            discount_code=order.discount.code if order.discount else '',
+            discount_percentage=order.discount.percentage if order.discount else None,
+            tax_name=order.tax.name if order.tax else '',
+            tax_percentage=order.tax.percentage if order.tax else None,
+            currency=pricing.currency,
+            subtotal=pricing.subtotal,
+            discount_amount=pricing.discount,
+            tax_amount=pricing.tax,
+            total_amount=pricing.total,
+        )
@@ -0,0 +1,410 @@
+"""
+Rate Limiting Module
+
+Protects the payment-creation endpoints from bots and retry storms that would
+otherwise burn through the Stripe API rate limit.
+
+Main Components:
+    - TokenBucketLimiter: Token-bucket limiter stored in a configurable Django cache.
+    - SingleFlight: Coalesces concurrent identical requests onto one in-flight call,
+      across processes, using a lock and a stored result in the shared cache.
+    - payment_ratelimit: View decorator combining both and returning 429 responses.
+    - get_metrics: Snapshot of throttled / coalesced / allowed request counters.
+
+Settings:
+    - STORE_RATELIMIT_CACHE (str): Alias of the cache in CACHES used for buckets.
+    - STORE_RATELIMIT_CLIENT_RATE / STORE_RATELIMIT_CLIENT_BURST: Refill rate
+      (tokens per second) and capacity of the per-client bucket.
+    - STORE_RATELIMIT_OBJECT_RATE / STORE_RATELIMIT_OBJECT_BURST: Refill rate
+      and capacity of the per-item / per-order bucket.
+    - STORE_RATELIMIT_TRUSTED_PROXIES (int): Number of trusted reverse proxies in
+      front of the app. 0 identifies clients by REMOTE_ADDR; behind a proxy that
+      means every visitor shares the proxy's bucket. N > 0 uses the X-Forwarded-For
+      entry N positions from the right.
+    - STORE_RATELIMIT_COALESCE_TIMEOUT (int): Seconds a coalesced request waits
+      for the in-flight one before calling the view itself.
+
+The default locmem cache is per process: with several workers (gunicorn) point
+STORE_RATELIMIT_CACHE at a shared backend, otherwise limits, coalescing and
+metrics only apply within each worker.
+"""
+
+import functools
+import hashlib
+import math
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+DEFAULTS = {
+    'STORE_RATELIMIT_CACHE': 'default',
+    'STORE_RATELIMIT_CLIENT_RATE': 0.5,
+    'STORE_RATELIMIT_CLIENT_BURST': 10,
+    'STORE_RATELIMIT_OBJECT_RATE': 2.0,
+    'STORE_RATELIMIT_OBJECT_BURST': 30,
+    'STORE_RATELIMIT_TRUSTED_PROXIES': 0,
+    'STORE_RATELIMIT_COALESCE_TIMEOUT': 30,
+}
+
+# Lifetime of a bucket lock, in case its holder dies before releasing it.
+LOCK_TIMEOUT = 2
+# How long a request waits for a contended bucket lock before being throttled.
+LOCK_WAIT = 0.5
+# Lifetime of a coalesced result, long enough for every waiting follower to read it.
+RESULT_TIMEOUT = 10
+POLL_INTERVAL = 0.01
+
+
+def _setting(name):
+    return getattr(settings, name, DEFAULTS[name])
+
+
+def _cache():
+    return caches[_setting('STORE_RATELIMIT_CACHE')]
+
+
+def acquire_lock(cache, key, token, timeout, wait):
+    """
+    Takes a lock stored in `cache` under `key`, polling for up to `wait` seconds.
+
+    Relies on the atomic `cache.add`, so the lock is shared by every process
+    using the same cache backend.
+
+    :return: True if the lock was acquired.
+    """
+    deadline = time.monotonic() + wait
+    while not cache.add(key, token, timeout):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+    return True
+
+
+def release_lock(cache, key, token):
+    """
+    Releases a lock taken by acquire_lock, unless it has expired and been
+    taken over by another holder.
+    """
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+class RateLimitMetrics:
+    """
+    Counters describing limiter decisions, kept in the rate limiting cache so
+    that all worker processes sharing it report the same numbers.
+    """
+
+    key_prefix = 'store:ratelimit:metrics:'
+    names = ('allowed', 'throttled', 'coalesced')
+
+    def __init__(self):
+        self.scopes = set()
+
+    def register(self, scope):
+        """
+        Registers an endpoint scope so that its counters show up in snapshots.
+        """
+        self.scopes.add(scope)
+
+    def _keys(self):
+        keys = list(self.names)
+        for scope in sorted(self.scopes):
+            keys.extend(f"{scope}.{name}" for name in self.names)
+        return keys
+
+    def incr(self, name, scope):
+        """
+        Increments the counter `name` both globally and for the given scope.
+        """
+        cache = _cache()
+        for key in (name, f"{scope}.{name}"):
+            cache.add(self.key_prefix + key, 0, None)
+            try:
+                cache.incr(self.key_prefix + key)
+            except ValueError:
+                cache.set(self.key_prefix + key, 1, None)
+
+    def snapshot(self):
+        """
+        Returns all counters, including the ones that are still zero.
+        """
+        keys = self._keys()
+        values = _cache().get_many([self.key_prefix + key for key in keys])
+        return {key: values.get(self.key_prefix + key, 0) for key in keys}
+
+    def reset(self):
+        """
+        Clears all counters.
+        """
+        _cache().delete_many([self.key_prefix + key for key in self._keys()])
+
+
+metrics = RateLimitMetrics()
+
+
+def get_metrics():
+    """
+    Returns the current limiter counters, e.g. {'throttled': 3, 'buy.throttled': 2, ...}.
+    """
+    return metrics.snapshot()
+
+
+class TokenBucketLimiter:
+    """
+    Token-bucket rate limiter whose state lives in a Django cache.
+
+    Each bucket is stored as a (tokens, timestamp) pair; tokens are refilled
+    lazily on access. Any cache backend from CACHES can be plugged in through
+    STORE_RATELIMIT_CACHE — use a shared one (Redis, Memcached, database) when
+    running several worker processes. Every bucket update is guarded by a
+    per-bucket lock taken with `cache.add`, so concurrent requests cannot lose
+    each other's updates, while requests for different buckets never wait on
+    each other.
+    """
+
+    key_prefix = 'store:ratelimit:'
+
+    def __init__(self, cache_alias=None):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        """
+        Returns the configured cache backend.
+        """
+        return caches[self.cache_alias or _setting('STORE_RATELIMIT_CACHE')]
+
+    def consume(self, key, rate, burst, tokens=1):
+        """
+        Tries to take `tokens` from the bucket identified by `key`.
+
+        A request that cannot get the bucket lock within LOCK_WAIT seconds is
+        treated as throttled: the bucket is under heavy contention.
+
+        :param key: Bucket identifier.
+        :param rate: Refill rate in tokens per second.
+        :param burst: Bucket capacity.
+        :param tokens: Number of tokens to consume.
+        :return: Tuple (allowed, retry_after) where retry_after is in seconds.
+        """
+        cache = self.cache
+        cache_key = self.key_prefix + key
+        lock_key = cache_key + ':lock'
+        lock_token = uuid.uuid4().hex
+        # Keep idle buckets around just long enough to refill completely.
+        timeout = max(1, math.ceil(burst / rate)) if rate > 0 else None
+
+        if not acquire_lock(cache, lock_key, lock_token, LOCK_TIMEOUT, LOCK_WAIT):
+            return False, LOCK_WAIT
+
+        try:
+            now = time.time()
+            available, updated_at = cache.get(cache_key, (burst, now))
+            available = min(burst, available + (now - updated_at) * rate)
+
+            if available >= tokens:
+                cache.set(cache_key, (available - tokens, now), timeout)
+                return True, 0
+
+            cache.set(cache_key, (available, now), timeout)
+            retry_after = (tokens - available) / rate if rate > 0 else None
+            return False, retry_after
+        finally:
+            release_lock(cache, lock_key, lock_token)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing the same key onto one execution.
+
+    The first caller takes a lock in the shared cache and runs the function;
+    callers arriving while it is in flight — in any process using the same
+    cache — poll for the result it stores and return that instead. If the
+    leader fails without a result, a waiting caller takes over; if waiting
+    takes longer than `timeout`, the caller runs the function itself.
+    """
+
+    key_prefix = 'store:singleflight:'
+
+    def __init__(self, cache_alias=None):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        """
+        Returns the configured cache backend.
+        """
+        return caches[self.cache_alias or _setting('STORE_RATELIMIT_CACHE')]
+
+    def _result_key(self, flight_id):
+        return f"{self.key_prefix}result:{flight_id}"
+
+    def do(self, key, func, serialize=None, timeout=None):
+        """
+        Runs `func` once for all concurrent callers with the same `key`.
+
+        :param key: String identifying identical calls.
+        :param func: Callable producing the result.
+        :param serialize: Converts the result into the picklable value shared with
+            followers (defaults to the result itself).
+        :param timeout: Seconds a follower waits for the leader
+            (defaults to STORE_RATELIMIT_COALESCE_TIMEOUT).
+        :return: Tuple (result, shared). Coalesced callers get shared=True and the
+            serialized result.
+        """
+        cache = self.cache
+        lock_key = self.key_prefix + key
+        if timeout is None:
+            timeout = _setting('STORE_RATELIMIT_COALESCE_TIMEOUT')
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            flight_id = uuid.uuid4().hex
+            if cache.add(lock_key, flight_id, math.ceil(timeout)):
+                try:
+                    result = func()
+                    value = serialize(result) if serialize else result
+                    cache.set(self._result_key(flight_id), value, RESULT_TIMEOUT)
+                finally:
+                    release_lock(cache, lock_key, flight_id)
+                return result, False
+
+            leader_id = cache.get(lock_key)
+            if leader_id is None:
+                continue
+            while True:
+                value = cache.get(self._result_key(leader_id))
+                if value is not None:
+                    return value, True
+                if cache.get(lock_key) != leader_id:
+                    break
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(POLL_INTERVAL)
+
+            # The leader stores its result before releasing the lock.
+            value = cache.get(self._result_key(leader_id))
+            if value is not None:
+                return value, True
+
+        return func(), False
+
+
+limiter = TokenBucketLimiter()
+single_flight = SingleFlight()
+
+
+def get_client_ip(request):
+    """
+    Returns the address used to identify the client for rate limiting.
+
+    With STORE_RATELIMIT_TRUSTED_PROXIES = N > 0 the address is taken N entries
+    from the right of X-Forwarded-For — the one appended by the outermost
+    trusted proxy. Entries further left are set by the client and ignored.
+    """
+    proxies = _setting('STORE_RATELIMIT_TRUSTED_PROXIES')
+    if proxies > 0:
+        forwarded = [address.strip()
+                     for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+                     if address.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', 'unknown')
+
+
+def get_flight_owner(request):
+    """
+    Returns an identifier of the browser that sent the request, or None.
+
+    Uses the Idempotency-Key header if the client sends one, otherwise the
+    session key. Only requests from the same browser may share a response,
+    since it contains a client_secret or session id meant for one buyer.
+    """
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        owner = f"idempotency:{idempotency_key}"
+    else:
+        session = getattr(request, 'session', None)
+        session_key = session.session_key if session is not None else None
+        if not session_key:
+            return None
+        owner = f"session:{session_key}"
+    # Hashed so that session keys do not end up in cache keys.
+    return hashlib.sha256(owner.encode()).hexdigest()
+
+
+def _too_many_requests(retry_after):
+    response = JsonResponse({'error': 'Too many requests. Please try again later.'},
+                            status=429)
+    if retry_after is not None:
+        response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _response_state(response):
+    return response.status_code, response.content, response.get('Content-Type')
+
+
+def _response_from_state(state):
+    status, content, content_type = state
+    return HttpResponse(content, status=status, content_type=content_type)
+
+
+def payment_ratelimit(scope, object_kwarg):
+    """
+    Decorator for views that create Stripe objects.
+
+    Applies a per-client and a per-object (item/order) token bucket, returning
+    HTTP 429 with a Retry-After header when either is empty, and coalesces
+    concurrent identical requests from the same browser (see get_flight_owner)
+    onto one view call, across all processes sharing the rate limiting cache.
+    Requests without an Idempotency-Key header or a session are never coalesced.
+
+    :param scope: Short name of the endpoint, used in bucket keys and metrics.
+    :param object_kwarg: Name of the view kwarg identifying the item or order.
+    """
+    metrics.register(scope)
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            client = get_client_ip(request)
+            object_id = kwargs.get(object_kwarg)
+
+            buckets = (
+                (f"client:{client}",
+                 _setting('STORE_RATELIMIT_CLIENT_RATE'),
+                 _setting('STORE_RATELIMIT_CLIENT_BURST')),
+                (f"{scope}:{object_id}",
+                 _setting('STORE_RATELIMIT_OBJECT_RATE'),
+                 _setting('STORE_RATELIMIT_OBJECT_BURST')),
+            )
+            for key, rate, burst in buckets:
+                allowed, retry_after = limiter.consume(key, rate, burst)
+                if not allowed:
+                    metrics.incr('throttled', scope)
+                    return _too_many_requests(retry_after)
+
+            owner = get_flight_owner(request)
+            if owner is None:
+                metrics.incr('allowed', scope)
+                return view_func(request, *args, **kwargs)
+
+            flight_key = f"{scope}:{owner}:{request.method}:{object_id}"
+            response, shared = single_flight.do(
+                flight_key, lambda: view_func(request, *args, **kwargs),
+                serialize=_response_state)
+            if shared:
+                metrics.incr('coalesced', scope)
+                return _response_from_state(response)
+
+            metrics.incr('allowed', scope)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,674 @@
+"""
+Tests Module
+
+Covers rate limiting and request coalescing of the payment-creation endpoints,
+order archival and exchange rate conversion.
+"""
+
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import fx
+from .models import ArchivedOrder, Discount, ExchangeRate, Item, Order, Tax
+from .ratelimit import (
+    SingleFlight, TokenBucketLimiter, get_client_ip, get_metrics, payment_ratelimit
+)
+
+
+class TokenBucketLimiterTests(SimpleTestCase):
+    """
+    Tests for the cache-backed token bucket.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.limiter = TokenBucketLimiter()
+
+    def test_allows_burst_then_denies(self):
+        """
+        A full bucket allows `burst` requests, then denies.
+        """
+        results = [self.limiter.consume('bucket', rate=1, burst=3)[0] for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+
+    def test_denied_request_reports_retry_after(self):
+        """
+        A denied request reports when the next token is due.
+        """
+        self.limiter.consume('bucket', rate=0.5, burst=1)
+        allowed, retry_after = self.limiter.consume('bucket', rate=0.5, burst=1)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 1)
+        self.assertLessEqual(retry_after, 2)
+
+    def test_buckets_are_independent(self):
+        """
+        Emptying one bucket does not affect another.
+        """
+        self.limiter.consume('first', rate=1, burst=1)
+        self.assertFalse(self.limiter.consume('first', rate=1, burst=1)[0])
+        self.assertTrue(self.limiter.consume('second', rate=1, burst=1)[0])
+
+    def test_tokens_refill_over_time(self):
+        """
+        Tokens are refilled at the configured rate.
+        """
+        self.limiter.consume('bucket', rate=20, burst=1)
+        self.assertFalse(self.limiter.consume('bucket', rate=20, burst=1)[0])
+        time.sleep(0.1)
+        self.assertTrue(self.limiter.consume('bucket', rate=20, burst=1)[0])
+
+    def test_concurrent_requests_do_not_exceed_burst(self):
+        """
+        Concurrent consumers cannot take more than `burst` tokens.
+        """
+        results = []
+
+        def consume():
+            results.append(self.limiter.consume('bucket', rate=0.01, burst=5)[0])
+
+        threads = [threading.Thread(target=consume) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 5)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """
+    Tests for coalescing concurrent identical calls.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_two_threads_share_one_call(self):
+        """
+        A concurrent identical call waits for and reuses the first result.
+        """
+        flight = SingleFlight()
+        calls = []
+        results = []
+        started = threading.Event()
+
+        def slow():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return 'result'
+
+        def leader():
+            results.append(flight.do('key', slow))
+
+        def follower():
+            started.wait()
+            results.append(flight.do('key', slow))
+
+        threads = [threading.Thread(target=leader), threading.Thread(target=follower)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertCountEqual(results, [('result', False), ('result', True)])
+
+    def test_sequential_calls_are_not_coalesced(self):
+        """
+        A finished call result is not reused by later calls.
+        """
+        flight = SingleFlight()
+        self.assertEqual(flight.do('key', lambda: 1), (1, False))
+        self.assertEqual(flight.do('key', lambda: 2), (2, False))
+
+    def test_follower_takes_over_when_leader_fails(self):
+        """
+        A waiting caller runs the function itself if the first one fails.
+        """
+        flight = SingleFlight()
+        results = []
+        started = threading.Event()
+
+        def failing():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        def leader():
+            try:
+                flight.do('key', failing)
+            except ValueError:
+                results.append('failed')
+
+        def follower():
+            started.wait()
+            results.append(flight.do('key', lambda: 'retried'))
+
+        threads = [threading.Thread(target=leader), threading.Thread(target=follower)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertCountEqual(results, ['failed', ('retried', False)])
+
+
+@override_settings(STORE_RATELIMIT_CLIENT_RATE=0.5, STORE_RATELIMIT_CLIENT_BURST=2,
+                   STORE_RATELIMIT_OBJECT_RATE=0.5, STORE_RATELIMIT_OBJECT_BURST=10)
+class PaymentRateLimitTests(SimpleTestCase):
+    """
+    Tests for the payment_ratelimit view decorator.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+        @payment_ratelimit('test_scope', 'item_id')
+        def view(request, item_id):
+            return JsonResponse({'item_id': item_id})
+
+        self.view = view
+
+    def test_returns_429_with_retry_after(self):
+        """
+        An exhausted client bucket yields 429 with Retry-After.
+        """
+        self.assertEqual(self.view(self.factory.get('/'), item_id=1).status_code, 200)
+        self.assertEqual(self.view(self.factory.get('/'), item_id=2).status_code, 200)
+
+        response = self.view(self.factory.get('/'), item_id=3)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_clients_are_limited_separately(self):
+        """
+        Each client address has its own bucket.
+        """
+        for _ in range(2):
+            self.view(self.factory.get('/', REMOTE_ADDR='10.0.0.1'), item_id=1)
+        other = self.view(self.factory.get('/', REMOTE_ADDR='10.0.0.2'), item_id=1)
+        self.assertEqual(other.status_code, 200)
+
+    def test_metrics_count_allowed_and_throttled(self):
+        """
+        Decisions are counted per scope.
+        """
+        for _ in range(3):
+            self.view(self.factory.get('/'), item_id=1)
+        counters = get_metrics()
+        self.assertEqual(counters['test_scope.allowed'], 2)
+        self.assertEqual(counters['test_scope.throttled'], 1)
+        self.assertEqual(counters['test_scope.coalesced'], 0)
+
+
+@override_settings(STORE_RATELIMIT_CLIENT_BURST=100, STORE_RATELIMIT_OBJECT_BURST=100)
+class PaymentCoalescingTests(SimpleTestCase):
+    """
+    Tests for coalescing concurrent requests in the payment_ratelimit decorator.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.calls = []
+        started = threading.Event()
+        self.started = started
+
+        @payment_ratelimit('coalesce_scope', 'item_id')
+        def view(request, item_id):
+            self.calls.append(request)
+            secret = f"secret-{len(self.calls)}"
+            started.set()
+            time.sleep(0.2)
+            return JsonResponse({'secret': secret})
+
+        self.view = view
+
+    def make_request(self, session_key=None, **extra):
+        """
+        Builds a GET request from the same address with an optional session.
+        """
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1', **extra)
+        if session_key is not None:
+            request.session = mock.Mock(session_key=session_key)
+        return request
+
+    def run_concurrently(self, first, second):
+        """
+        Sends `second` while `first` is still being handled; returns both bodies.
+        """
+        responses = {}
+
+        def send(name, request, wait):
+            if wait:
+                self.started.wait()
+            responses[name] = self.view(request, item_id=1).content
+
+        threads = [threading.Thread(target=send, args=('first', first, False)),
+                   threading.Thread(target=send, args=('second', second, True))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses['first'], responses['second']
+
+    def test_same_session_is_coalesced(self):
+        """
+        Concurrent identical requests from one session share one view call.
+        """
+        first, second = self.run_concurrently(self.make_request('session-a'),
+                                              self.make_request('session-a'))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(get_metrics()['coalesce_scope.coalesced'], 1)
+
+    def test_different_sessions_on_same_ip_are_not_coalesced(self):
+        """
+        Two buyers behind one address never receive each other's response.
+        """
+        first, second = self.run_concurrently(self.make_request('session-a'),
+                                              self.make_request('session-b'))
+        self.assertEqual(len(self.calls), 2)
+        self.assertNotEqual(first, second)
+
+    def test_requests_without_session_are_not_coalesced(self):
+        """
+        Requests that cannot be tied to a browser are never coalesced.
+        """
+        self.run_concurrently(self.make_request(), self.make_request())
+        self.assertEqual(len(self.calls), 2)
+
+    def test_idempotency_key_is_coalesced(self):
+        """
+        Requests sharing an Idempotency-Key header share one view call.
+        """
+        self.run_concurrently(self.make_request(HTTP_IDEMPOTENCY_KEY='abc'),
+                              self.make_request(HTTP_IDEMPOTENCY_KEY='abc'))
+        self.assertEqual(len(self.calls), 1)
+
+
+class ClientIpTests(SimpleTestCase):
+    """
+    Tests for identifying clients behind reverse proxies.
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_ignores_forwarded_for_without_trusted_proxies(self):
+        """
+        By default X-Forwarded-For is ignored.
+        """
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1',
+                                   HTTP_X_FORWARDED_FOR='1.2.3.4')
+        self.assertEqual(get_client_ip(request), '10.0.0.1')
+
+    @override_settings(STORE_RATELIMIT_TRUSTED_PROXIES=1)
+    def test_uses_entry_added_by_trusted_proxy(self):
+        """
+        Client-supplied entries on the left cannot change the identified address.
+        """
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1',
+                                   HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4')
+        self.assertEqual(get_client_ip(request), '1.2.3.4')
+
+    @override_settings(STORE_RATELIMIT_TRUSTED_PROXIES=2)
+    def test_counts_proxies_from_the_right(self):
+        """
+        With N proxies the N-th entry from the right is used.
+        """
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1',
+                                   HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4, 10.0.0.2')
+        self.assertEqual(get_client_ip(request), '1.2.3.4')
+
+    @override_settings(STORE_RATELIMIT_TRUSTED_PROXIES=2)
+    def test_falls_back_to_remote_addr_for_short_header(self):
+        """
+        A header shorter than the proxy chain is not trusted.
+        """
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1',
+                                   HTTP_X_FORWARDED_FOR='6.6.6.6')
+        self.assertEqual(get_client_ip(request), '10.0.0.1')
+
+
+class ArchiveOrdersCommandTests(TestCase):
+    """
+    Tests for the archive_orders management command and archived order pages.
+    """
+
+    def setUp(self):
+        self.first = Item.objects.create(name='Book', price='10.00', currency='usd')
+        self.second = Item.objects.create(name='Pen', price='5.00', currency='usd')
+        self.discount = Discount.objects.create(code='SAVE10', percentage='10.00')
+        self.tax = Tax.objects.create(name='VAT', percentage='20.00')
+
+    def create_order(self, days_ago):
+        """
+        Creates an order with both items, backdated by `days_ago` days.
+        """
+        order = Order.objects.create(discount=self.discount, tax=self.tax)
+        order.items.set([self.first, self.second])
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.now() - timedelta(days=days_ago))
+        return order
+
+    def test_moves_old_orders_with_totals(self):
+        """
+        Old orders are snapshotted into the archive and removed with their item links.
+        """
+        old = self.create_order(days_ago=400)
+        recent = self.create_order(days_ago=10)
+
+        call_command('archive_orders', days=365, stdout=StringIO())
+
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertFalse(Order.items.through.objects.filter(order_id=old.pk).exists())
+        archived = ArchivedOrder.objects.get(pk=old.pk)
+        self.assertEqual([item['item_id'] for item in archived.items],
+                         [self.first.pk, self.second.pk])
+        self.assertEqual(archived.discount_code, 'SAVE10')
+        self.assertEqual(str(archived.subtotal), '15.00')
+        self.assertEqual(str(archived.total_amount), '16.20')
+
+    def test_respects_batch_size(self):
+        """
+        Orders are moved in batches of at most --batch-size.
+        """
+        for _ in range(5):
+            self.create_order(days_ago=400)
+        out = StringIO()
+
+        call_command('archive_orders', days=365, batch_size=2, stdout=out)
+
+        batches = [line for line in out.getvalue().splitlines() if 'so far' in line]
+        self.assertEqual(len(batches), 3)
+        self.assertIn('Archived 2 order(s) (2 so far).', batches[0])
+        self.assertIn('Archived 1 order(s) (5 so far).', batches[2])
+        self.assertEqual(ArchivedOrder.objects.count(), 5)
+
+    def test_dry_run_changes_nothing(self):
+        """
+        --dry-run only reports the number of orders.
+        """
+        self.create_order(days_ago=400)
+        out = StringIO()
+
+        call_command('archive_orders', days=365, dry_run=True, stdout=out)
+
+        self.assertIn('1 order(s)', out.getvalue())
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+    def test_order_detail_serves_archived_order(self):
+        """
+        An archived order is still rendered, read-only, at its old URL.
+        """
+        order = self.create_order(days_ago=400)
+        call_command('archive_orders', days=365, stdout=StringIO())
+
+        response = self.client.get(reverse('store:order_detail', args=[order.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'store/order_archived.html')
+        self.assertContains(response, 'Total: 16.20 USD')
+        self.assertNotContains(response, 'pay-button')
+
+    def test_order_detail_404_for_unknown_order(self):
+        """
+        An ID that is neither live nor archived yields 404.
+        """
+        response = self.client.get(reverse('store:order_detail', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ConvertTests(SimpleTestCase):
+    """
+    Tests for fx.convert.
+    """
+
+    rates = {'usd': Decimal('1'), 'pln': Decimal('3.9')}
+
+    def test_same_currency_is_unchanged(self):
+        """
+        Converting into the same currency returns the amount as is.
+        """
+        self.assertEqual(fx.convert(Decimal('10.005'), 'usd', 'USD', self.rates),
+                         Decimal('10.005'))
+
+    def test_rounds_half_up_to_cents(self):
+        """
+        Converted amounts are rounded half up to two decimal places.
+        """
+        self.assertEqual(fx.convert(Decimal('10'), 'pln', 'usd', self.rates), Decimal('2.56'))
+        self.assertEqual(fx.convert(Decimal('0.5'), 'usd', 'pln', {'usd': Decimal('1'),
+                                                                  'pln': Decimal('0.01')}),
+                         Decimal('0.01'))
+
+    def test_missing_rate_raises(self):
+        """
+        A currency without a rate raises ExchangeRateMissing.
+        """
+        with self.assertRaises(fx.ExchangeRateMissing):
+            fx.convert(Decimal('10'), 'pln', 'usd', {'usd': Decimal('1')})
+
+
+class RateTableCacheTests(TestCase):
+    """
+    Tests for the in-process exchange rate cache.
+    """
+
+    def setUp(self):
+        cache.clear()
+        fx.rate_table.clear()
+
+    def test_cached_table_is_reused(self):
+        """
+        Repeated lookups only check the version, without reloading the rates.
+        """
+        fx.get_rates()
+        with self.assertNumQueries(1):
+            fx.get_rates()
+
+    def test_saved_rate_is_picked_up(self):
+        """
+        A rate saved by another process changes the version and is reloaded.
+        """
+        rate = ExchangeRate.objects.create(currency='pln', rate='4')
+        self.assertEqual(fx.get_rates()['pln'], Decimal('4'))
+
+        rate.rate = Decimal('5')
+        rate.save()
+        self.assertEqual(fx.get_rates()['pln'], Decimal('5'))
+
+    def test_deleted_rate_is_picked_up(self):
+        """
+        Deleting a rate changes the version and removes it from the table.
+        """
+        ExchangeRate.objects.create(currency='pln', rate='4')
+        self.assertIn('pln', fx.get_rates())
+
+        ExchangeRate.objects.all().delete()
+        self.assertNotIn('pln', fx.get_rates())
+
+    def test_unchanged_version_keeps_table(self):
+        """
+        Changes that bypass updated_at are not seen before the TTL expires.
+        """
+        ExchangeRate.objects.create(currency='pln', rate='4')
+        fx.get_rates()
+
+        ExchangeRate.objects.filter(currency='pln').update(rate='5')
+        self.assertEqual(fx.get_rates()['pln'], Decimal('4'))
+
+    @override_settings(STORE_FX_TTL=60)
+    def test_ttl_expiry_reloads(self):
+        """
+        The cached table is reloaded once it is older than STORE_FX_TTL.
+        """
+        ExchangeRate.objects.create(currency='pln', rate='4')
+        fx.get_rates()
+        ExchangeRate.objects.filter(currency='pln').update(rate='5')
+
+        with mock.patch('store.fx.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(fx.get_rates()['pln'], Decimal('5'))
+
+
+class MixedCurrencyOrderTests(TestCase):
+    """
+    Tests for pricing orders whose items use different currencies.
+    """
+
+    def setUp(self):
+        cache.clear()
+        fx.rate_table.clear()
+        self.usd_item = Item.objects.create(name='Book', price='10.00', currency='usd')
+        self.pln_item = Item.objects.create(name='Pen', price='20.00', currency='pln')
+        self.order = Order.objects.create(
+            discount=Discount.objects.create(code='SAVE10', percentage=Decimal('10.00')),
+            tax=Tax.objects.create(name='VAT', percentage=Decimal('20.00')),
+        )
+        self.order.items.set([self.usd_item, self.pln_item])
+
+    def test_totals_in_settlement_currency(self):
+        """
+        PLN lines are converted into the order's USD settlement currency.
+        """
+        ExchangeRate.objects.create(currency='pln', rate='4')
+
+        self.assertEqual(self.order.currency(), 'usd')
+        self.assertEqual(self.order.subtotal(), Decimal('15.00'))
+        self.assertEqual(self.order.discount_amount(), Decimal('1.50'))
+        self.assertEqual(self.order.tax_amount(), Decimal('2.70'))
+        self.assertEqual(self.order.total_amount(), Decimal('16.20'))
+
+    def test_explicit_settlement_currency(self):
+        """
+        settlement_currency overrides the first item's currency.
+        """
+        ExchangeRate.objects.create(currency='pln', rate='4')
+        self.order.settlement_currency = 'pln'
+
+        self.assertEqual(self.order.subtotal(), Decimal('60.00'))
+
+    def test_pricing_converts_once(self):
+        """
+        total_amount prices the order with one items query and one version check.
+        """
+        ExchangeRate.objects.create(currency='pln', rate='4')
+        fx.get_rates()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.order.total_amount(), Decimal('16.20'))
+
+    def test_payment_intent_missing_rate_returns_400(self):
+        """
+        The PaymentIntent endpoint reports a missing rate instead of failing.
+        """
+        with mock.patch('store.views.stripe.PaymentIntent.create') as create:
+            response = self.client.get(
+                reverse('store:create_payment_intent', args=[self.order.pk]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'No exchange rate for PLN.'})
+        create.assert_not_called()
+
+    def test_payment_intent_uses_converted_total(self):
+        """
+        The PaymentIntent amount is the converted total in cents.
+        """
+        ExchangeRate.objects.create(currency='pln', rate='4')
+        with mock.patch('store.views.stripe.PaymentIntent.create') as create:
+            create.return_value.client_secret = 'secret'
+            response = self.client.get(
+                reverse('store:create_payment_intent', args=[self.order.pk]))
+
+        self.assertEqual(response.json(), {'client_secret': 'secret'})
+        create.assert_called_once_with(amount=1620, currency='usd',
+                                       metadata={'order_id': str(self.order.pk)})
+
+    def test_order_detail_missing_rate_renders_error(self):
+        """
+        The order page reports a missing rate instead of failing the render.
+        """
+        response = self.client.get(reverse('store:order_detail', args=[self.order.pk]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'No exchange rate for PLN.', status_code=400)
+        self.assertNotContains(response, 'id="pay-button"', status_code=400)
+
+    def test_archive_skips_orders_with_missing_rate(self):
+        """
+        archive_orders leaves unpriceable orders in place and archives the rest.
+        """
+        usd_order = Order.objects.create()
+        usd_order.items.set([self.usd_item])
+        Order.objects.update(created_at=timezone.now() - timedelta(days=400))
+        err = StringIO()
+
+        call_command('archive_orders', days=365, stdout=StringIO(), stderr=err)
+
+        self.assertEqual(list(ArchivedOrder.objects.values_list('pk', flat=True)),
+                         [usd_order.pk])
+        self.assertTrue(Order.objects.filter(pk=self.order.pk).exists())
+        self.assertIn(f'#{self.order.pk}', err.getvalue())
+
+
+class LoadExchangeRatesCommandTests(TestCase):
+    """
+    Tests for the load_exchange_rates management command.
+    """
+
+    def write_file(self, name, content):
+        """
+        Writes `content` to a temporary file and returns its path.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = Path(directory) / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def test_loads_json_and_rate_options(self):
+        """
+        Rates from a JSON file and --rate are stored.
+        """
+        path = self.write_file('rates.json', json.dumps({'base': 'usd', 'rates': {'pln': '3.95'}}))
+        call_command('load_exchange_rates', path, stdout=StringIO())
+        self.assertEqual(ExchangeRate.objects.get(currency='pln').rate, Decimal('3.95'))
+
+        call_command('load_exchange_rates', rate=['pln=4.1'], stdout=StringIO())
+        self.assertEqual(ExchangeRate.objects.get(currency='pln').rate, Decimal('4.1'))
+
+    def test_rejects_json_of_wrong_shape(self):
+        """
+        Valid JSON that is not a {'rates': {...}} object is rejected.
+        """
+        for content in ('[1, 2]', '3', '{"rates": ["pln", 4]}'):
+            path = self.write_file('rates.json', content)
+            with self.assertRaises(CommandError):
+                call_command('load_exchange_rates', path, stdout=StringIO())
+
+    def test_rejects_base_currency(self):
+        """
+        The base currency cannot be given a rate.
+        """
+        with self.assertRaises(CommandError):
+            call_command('load_exchange_rates', rate=['usd=1.1'], stdout=StringIO())
+        self.assertFalse(ExchangeRate.objects.exists())
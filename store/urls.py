@@ -22,6 +22,8 @@ urlpatterns = [
     path("order/<int:order_id>/create-payment-intent/", views.create_payment_intent,
          name="create_payment_intent"),
 
+    path('metrics/ratelimit/', views.ratelimit_metrics_view, name='ratelimit_metrics'),
+
     path('success/', views.success_view, name='success'),
     path('cancel/', views.cancel_view, name='canceled'),
 ]
@@ -8,23 +8,29 @@ Main Views:
     - item_view: Renders a product detail page with Stripe publishable key.
     - success_view: Simple HTML response for successful payment.
     - cancel_view: Simple HTML response for canceled payment.
+    - ratelimit_metrics_view: JSON counters of throttled and coalesced payment requests.
 
 Dependencies:
     - Stripe API for payment integration
     - Django shortcuts and HTTP utilities for request handling and rendering
     - Local Item model
+    - Local ratelimit module protecting the payment-creation endpoints
 """
 
 import stripe
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.http import JsonResponse, Http404, HttpResponse
 from django.shortcuts import render, get_object_or_404
-from .models import Item, Order
+from .fx import ExchangeRateMissing
+from .models import ArchivedOrder, Item, Order
+from .ratelimit import payment_ratelimit, get_metrics
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
 # single item views
+@payment_ratelimit('item_payment_intent', 'item_id')
 def item_payment_intent(request, item_id):
     """
     Creates a Stripe PaymentIntent for a single item and returns the client secret.
@@ -33,6 +39,7 @@ def item_payment_intent(request, item_id):
     :param item_id: ID of the item to create a PaymentIntent for.
     :return: JSON response containing the Stripe PaymentIntent client_secret.
     :raises Http404: If the request method is not GET or the item does not exist.
+    Responds with 429 when the client or the item is rate limited.
     """
     if request.method != "GET":
         raise Http404()
@@ -54,6 +61,7 @@ def item_payment_intent(request, item_id):
     return JsonResponse({"client_secret": intent.client_secret})
 
 
+@payment_ratelimit('buy', 'item_id')
 def buy_view(request, item_id):
     """
     Initiates a Stripe Checkout session for the specified item.
@@ -62,6 +70,7 @@ def buy_view(request, item_id):
     :param item_id: ID of the item to purchase.
     :return: JSON response containing the Stripe Checkout session ID.
     :raises Http404: If the request method is not GET or item does not exist.
+    Responds with 429 when the client or the item is rate limited.
     """
     if request.method != 'GET':
         raise Http404()
@@ -120,15 +129,33 @@ def order_detail_view(request, order_id):
     """
     Renders the order detail page with Payment Element and Stripe publishable key.
 
+    Orders moved out by `archive_orders` are rendered read-only from the archive.
+
     :param request: Django HttpRequest object.
     :param order_id: ID of the order to display.
-    :return: Rendered HTML page with order details and payment options.
-    :raises Http404: If the order does not exist.
+    :return: Rendered HTML page with order details and payment options, or with
+        an error instead of totals (status 400) if an exchange rate is missing.
+    :raises Http404: If the order does not exist, neither live nor archived.
     """
-    order = get_object_or_404(Order, pk=order_id)
+    try:
+        order = Order.objects.prefetch_related('items').get(pk=order_id)
+    except Order.DoesNotExist:
+        archived_order = get_object_or_404(ArchivedOrder, pk=order_id)
+        return render(request, 'store/order_archived.html', {'order': archived_order})
+
+    # Totals are computed here, not in the template, so a missing exchange rate
+    # is reported on the page instead of failing the render.
+    try:
+        pricing = order.pricing()
+        pricing_error = None
+    except ExchangeRateMissing as e:
+        pricing = None
+        pricing_error = str(e)
 
     context = {
         'order': order,
+        'pricing': pricing,
+        'pricing_error': pricing_error,
         'publishable_key': settings.STRIPE_PUBLISHABLE_KEY,
     }
 
@@ -137,25 +164,34 @@ def order_detail_view(request, order_id):
     else:
         url = 'store/order_detail.html'
 
-    return render(request, url, context)
+    return render(request, url, context, status=400 if pricing_error else 200)
 
 
+@payment_ratelimit('create_checkout_session', 'order_id')
 def create_checkout_session(request, order_id):
     """
     Creates a Stripe Checkout session for the given order and returns JSON response with session ID.
+    Item prices are converted into the order's settlement currency.
 
     :param request: Django HttpRequest object.
     :param order_id: ID of the order to create checkout session for.
     :return: JsonResponse containing Stripe session ID on success, or error message on failure.
+    Responds with 429 when the client or the order is rate limited.
     """
-    order = get_object_or_404(Order, pk=order_id)
+    order = get_object_or_404(Order.objects.prefetch_related('items'), pk=order_id)
+
+    try:
+        pricing = order.pricing()
+    except ExchangeRateMissing as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    currency = pricing.currency
 
     line_items = []
-    for item in order.items.all():
+    for item, price in pricing.lines:
         line_items.append({
             'price_data': {
-                'currency': item.currency,
-                'unit_amount': int(item.price * 100),
+                'currency': currency,
+                'unit_amount': int(price * 100),
                 'product_data': {
                     'name': item.name,
                 },
@@ -204,19 +240,25 @@ def create_checkout_session(request, order_id):
         return JsonResponse({'error': str(e)}, status=400)
 
 
+@payment_ratelimit('create_payment_intent', 'order_id')
 def create_payment_intent(request, order_id):
     """
     Creates a Stripe PaymentIntent for the given Order and returns client_secret.
+    The amount is the order total in its settlement currency.
     GET /order/<order_id>/create-payment-intent/
+    Responds with 429 when the client or the order is rate limited.
     """
     if request.method != "GET":
         raise Http404()
 
-    order = get_object_or_404(Order, pk=order_id)
+    order = get_object_or_404(Order.objects.prefetch_related('items'), pk=order_id)
 
-    total_decimal = order.total_amount()
-    amount = int(total_decimal * 100)   # cents
-    currency = order.currency()
+    try:
+        pricing = order.pricing()
+    except ExchangeRateMissing as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    amount = int(pricing.total * 100)   # cents
+    currency = pricing.currency
 
     try:
         intent = stripe.PaymentIntent.create(
@@ -230,6 +272,18 @@ def create_payment_intent(request, order_id):
     return JsonResponse({"client_secret": intent.client_secret})
 
 
+@staff_member_required
+def ratelimit_metrics_view(request):
+    """
+    Returns rate limiter counters (allowed, throttled, coalesced) stored in
+    STORE_RATELIMIT_CACHE, shared by all workers that use the same cache.
+
+    :param request: Django HttpRequest object (staff users only).
+    :return: JsonResponse with the counters, overall and per endpoint.
+    """
+    return JsonResponse(get_metrics())
+
+
 # status view
 def success_view(request):
     """